@@ -1,15 +1,38 @@
 import asyncio
+import functools
+import hashlib
 import logging
 import os
+from collections import OrderedDict
 from datetime import datetime
-from typing import Iterable
-from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
-
-from sqlalchemy import DateTime, Float, ForeignKey, String, Text, select
-from sqlalchemy.engine.url import make_url
-from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from typing import Awaitable, Callable, Sequence
+
+try:
+    import uvloop
+except ImportError:  # uvloop недоступен на Windows
+    uvloop = None
+
+from sqlalchemy import DateTime, Float, ForeignKey, Index, String, Text, func, insert, select
+from sqlalchemy import text as sql_text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.engine.url import URL, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Mapped,
+    declared_attr,
+    mapped_column,
+    relationship,
+    selectinload,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -29,7 +52,11 @@ logger = logging.getLogger(__name__)
 # --------------------
 
 
-class Base(AsyncAttrs, DeclarativeBase):
+# Время записи проставляет сама база (UTC, без часового пояса).
+UTC_NOW = func.timezone("UTC", func.now())
+
+
+class Base(DeclarativeBase):
     pass
 
 
@@ -39,37 +66,47 @@ class Pet(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=False), default=datetime.utcnow, nullable=False
+        DateTime(timezone=False), server_default=UTC_NOW, nullable=False
     )
 
+    # Ленивая подгрузка запрещена: историю загружаем явно через selectinload.
     weights: Mapped[list["WeightEntry"]] = relationship(
         back_populates="pet",
         cascade="all, delete-orphan",
         order_by="WeightEntry.timestamp",
+        lazy="raise_on_sql",
     )
     treatments: Mapped[list["TreatmentEntry"]] = relationship(
         back_populates="pet",
         cascade="all, delete-orphan",
         order_by="TreatmentEntry.timestamp",
+        lazy="raise_on_sql",
     )
     vaccines: Mapped[list["VaccineEntry"]] = relationship(
         back_populates="pet",
         cascade="all, delete-orphan",
         order_by="VaccineEntry.timestamp",
+        lazy="raise_on_sql",
     )
     events: Mapped[list["EventEntry"]] = relationship(
         back_populates="pet",
         cascade="all, delete-orphan",
         order_by="EventEntry.timestamp",
+        lazy="raise_on_sql",
     )
 
 
 class EntryBase:
     id: Mapped[int] = mapped_column(primary_key=True)
     timestamp: Mapped[datetime] = mapped_column(
-        DateTime(timezone=False), default=datetime.utcnow, nullable=False
+        DateTime(timezone=False), server_default=UTC_NOW, nullable=False
     )
 
+    @declared_attr.directive
+    def __table_args__(cls) -> tuple:
+        # История читается по питомцу в порядке времени.
+        return (Index(f"ix_{cls.__tablename__}_pet_ts", "pet_id", "timestamp"),)
+
 
 class WeightEntry(EntryBase, Base):
     __tablename__ = "weights"
@@ -77,7 +114,7 @@ class WeightEntry(EntryBase, Base):
     pet_id: Mapped[int] = mapped_column(ForeignKey("pets.id", ondelete="CASCADE"))
     value: Mapped[float] = mapped_column(Float, nullable=False)
 
-    pet: Mapped[Pet] = relationship(back_populates="weights")
+    pet: Mapped[Pet] = relationship(back_populates="weights", lazy="raise_on_sql")
 
 
 class TreatmentEntry(EntryBase, Base):
@@ -86,7 +123,7 @@ class TreatmentEntry(EntryBase, Base):
     pet_id: Mapped[int] = mapped_column(ForeignKey("pets.id", ondelete="CASCADE"))
     description: Mapped[str] = mapped_column(Text, nullable=False)
 
-    pet: Mapped[Pet] = relationship(back_populates="treatments")
+    pet: Mapped[Pet] = relationship(back_populates="treatments", lazy="raise_on_sql")
 
 
 class VaccineEntry(EntryBase, Base):
@@ -95,7 +132,7 @@ class VaccineEntry(EntryBase, Base):
     pet_id: Mapped[int] = mapped_column(ForeignKey("pets.id", ondelete="CASCADE"))
     description: Mapped[str] = mapped_column(Text, nullable=False)
 
-    pet: Mapped[Pet] = relationship(back_populates="vaccines")
+    pet: Mapped[Pet] = relationship(back_populates="vaccines", lazy="raise_on_sql")
 
 
 class EventEntry(EntryBase, Base):
@@ -104,33 +141,24 @@ class EventEntry(EntryBase, Base):
     pet_id: Mapped[int] = mapped_column(ForeignKey("pets.id", ondelete="CASCADE"))
     description: Mapped[str] = mapped_column(Text, nullable=False)
 
-    pet: Mapped[Pet] = relationship(back_populates="events")
-
+    pet: Mapped[Pet] = relationship(back_populates="events", lazy="raise_on_sql")
 
-def sanitize_db_url(url: str) -> str:
-    """Remove query parameters incompatible with the async driver."""
-
-    parsed_url = urlparse(url)
-    query = dict(parse_qsl(parsed_url.query, keep_blank_values=True))
-    query.pop("channel_binding", None)
-    new_query = urlencode(query)
-    return urlunparse(parsed_url._replace(query=new_query))
 
+def _make_async_url(url: str) -> tuple[URL, dict]:
+    """Parse the URL once, dropping query parameters incompatible with asyncpg."""
 
-def _make_async_url(url: str) -> tuple[str, dict]:
-    url_obj = make_url(sanitize_db_url(url))
-    sslmode = url_obj.query.get("sslmode")
+    url_obj = make_url(url)
+    # Схема опирается на функции PostgreSQL (timezone(), now()).
+    if not url_obj.drivername.startswith("postgres"):
+        raise RuntimeError("DATABASE_URL должен указывать на PostgreSQL.")
 
     query = dict(url_obj.query)
-    query.pop("sslmode", None)
+    query.pop("channel_binding", None)
+    sslmode = query.pop("sslmode", None)
 
     ssl_required = bool(sslmode and sslmode.lower() != "disable")
 
-    async_url = str(
-        url_obj.set(drivername="postgresql+asyncpg", query=query)
-        if url_obj.drivername.startswith("postgres")
-        else url_obj
-    )
+    async_url = url_obj.set(drivername="postgresql+asyncpg", query=query)
 
     connect_args = {"ssl": ssl_required} if ssl_required else {}
 
@@ -144,15 +172,70 @@ if not database_url:
 
 async_url, connect_args = _make_async_url(database_url)
 
+# Постоянные соединения пула вместо нового подключения на каждое обновление.
+pool_size = int(os.environ.get("DB_POOL_MIN", "10"))
+pool_max = int(os.environ.get("DB_POOL_MAX", "50"))
+if pool_max < pool_size:
+    raise RuntimeError("DB_POOL_MAX не может быть меньше DB_POOL_MIN.")
+
 engine = create_async_engine(
-    async_url, echo=False, future=True, connect_args=connect_args
+    async_url,
+    echo=False,
+    future=True,
+    connect_args=connect_args,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=pool_size,
+    max_overflow=pool_max - pool_size,
+    pool_pre_ping=True,
+    pool_recycle=300,
 )
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 
+async def _apply_server_defaults(conn: AsyncConnection) -> None:
+    """Set DB-side defaults on columns created before they were declared."""
+
+    # ALTER TABLE берёт ACCESS EXCLUSIVE, поэтому трогаем только колонки без DEFAULT.
+    result = await conn.execute(
+        sql_text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND column_default IS NULL"
+        )
+    )
+    missing = set(result.tuples())
+
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if column.server_default is None or (table.name, column.name) not in missing:
+                continue
+            default = column.server_default.arg.compile(
+                dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+            )
+            await conn.execute(
+                sql_text(
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ALTER COLUMN {preparer.format_column(column)} SET DEFAULT {default}"
+                )
+            )
+
+
+def _create_missing_indexes(conn: Connection) -> None:
+    """Create indexes on tables that create_all did not (re)create."""
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def init_db() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+        await _apply_server_defaults(conn)
+    # init_db выполняется в отдельном цикле событий: соединения пула привязаны
+    # к нему, поэтому закрываем их до запуска polling.
+    await engine.dispose()
 
 
 # --------------------
@@ -169,51 +252,126 @@ ADD_CARE = "ADD_CARE"
 ADD_VACCINE = "ADD_VACCINE"
 ADD_EVENT = "ADD_EVENT"
 
+# Десятичная запятая в вводе веса ("5,3").
+_DECIMAL_TRANSLATE = str.maketrans({",": "."})
+
+
+# Объекты telegram неизменяемы, поэтому одну клавиатуру можно переиспользовать.
+_MAIN_MENU_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("Добавить питомца", callback_data=ADD_PET)],
+        [InlineKeyboardButton("Список питомцев", callback_data=LIST_PETS)],
+        [InlineKeyboardButton("Информация о питомце", callback_data=PET_INFO)],
+        [InlineKeyboardButton("Добавить вес", callback_data=ADD_WEIGHT)],
+        [InlineKeyboardButton("Добавить обработку", callback_data=ADD_CARE)],
+        [InlineKeyboardButton("Добавить вакцинацию", callback_data=ADD_VACCINE)],
+        [InlineKeyboardButton("Добавить событие", callback_data=ADD_EVENT)],
+    ]
+)
+
+
+_MAIN_MENU_JSON = _MAIN_MENU_MARKUP.to_json().encode()
+
 
 def main_menu_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("Добавить питомца", callback_data=ADD_PET)],
-            [InlineKeyboardButton("Список питомцев", callback_data=LIST_PETS)],
-            [InlineKeyboardButton("Информация о питомце", callback_data=PET_INFO)],
-            [InlineKeyboardButton("Добавить вес", callback_data=ADD_WEIGHT)],
-            [InlineKeyboardButton("Добавить обработку", callback_data=ADD_CARE)],
-            [InlineKeyboardButton("Добавить вакцинацию", callback_data=ADD_VACCINE)],
-            [InlineKeyboardButton("Добавить событие", callback_data=ADD_EVENT)],
-        ]
-    )
+    return _MAIN_MENU_MARKUP
+
 
+EDIT_CACHE_SIZE = 1024
+# Дайджест последнего отправленного содержимого по (chat_id, message_id).
+_last_edits: OrderedDict[tuple[int, int], bytes] = OrderedDict()
 
-def format_entries(entries: Iterable[EntryBase], title: str, formatter=str) -> str:
-    entries_list = list(entries)
-    if not entries_list:
+
+def _markup_bytes(reply_markup: InlineKeyboardMarkup) -> bytes:
+    if reply_markup is _MAIN_MENU_MARKUP:
+        return _MAIN_MENU_JSON
+    return reply_markup.to_json().encode()
+
+
+async def edit_message(
+    query: CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup | None = None
+) -> None:
+    """Edit the callback message unless it already shows this text and keyboard."""
+
+    message = query.message
+    if message is None:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
+
+    key = (message.chat.id, message.message_id)
+    encoded = text.encode()
+    hasher = hashlib.blake2b(digest_size=16)
+    # Длина текста отделяет его от байтов клавиатуры в дайджесте.
+    hasher.update(len(encoded).to_bytes(4, "big"))
+    hasher.update(encoded)
+    if reply_markup is not None:
+        hasher.update(_markup_bytes(reply_markup))
+    digest = hasher.digest()
+
+    if _last_edits.get(key) == digest:
+        _last_edits.move_to_end(key)
+        return
+
+    await query.edit_message_text(text, reply_markup=reply_markup)
+    _last_edits[key] = digest
+    _last_edits.move_to_end(key)
+    if len(_last_edits) > EDIT_CACHE_SIZE:
+        _last_edits.popitem(last=False)
+
+
+def format_entries(entries: Sequence[EntryBase], title: str, formatter=str) -> str:
+    if not entries:
         return f"{title}: пока пусто"
 
-    lines = [
-        f"{entry.timestamp.strftime('%Y-%m-%d %H:%M:%S')}: {formatter(entry)}"
-        for entry in entries_list
-    ]
-    return f"{title}:\n" + "\n".join(lines)
+    body = "\n".join(
+        f"{entry.timestamp.isoformat(' ', 'seconds')}: {formatter(entry)}"
+        for entry in entries
+    )
+    return f"{title}:\n{body}"
 
 
-async def fetch_pets(session: AsyncSession) -> list[Pet]:
+async def fetch_pets(session: AsyncSession) -> Sequence[Pet]:
     result = await session.execute(select(Pet).order_by(Pet.name))
-    return list(result.scalars().all())
+    return result.scalars().all()
 
 
-async def ensure_pet(session: AsyncSession, name: str) -> Pet:
-    query = await session.execute(select(Pet).where(Pet.name == name))
-    pet = query.scalar_one_or_none()
-    if pet:
-        return pet
+async def fetch_pet_names(session: AsyncSession) -> Sequence[str]:
+    result = await session.scalars(select(Pet.name).order_by(Pet.name))
+    return result.all()
+
 
-    pet = Pet(name=name.strip())
-    session.add(pet)
+async def ensure_pet(session: AsyncSession, name: str) -> Pet:
+    # DO UPDATE вместо DO NOTHING, чтобы RETURNING вернул и уже существующую строку.
+    stmt = (
+        pg_insert(Pet)
+        .values(name=name.strip())
+        .on_conflict_do_update(index_elements=[Pet.name], set_={"name": Pet.name})
+        .returning(Pet)
+    )
+    pet = (await session.execute(stmt)).scalar_one()
     await session.commit()
-    await session.refresh(pet)
     return pet
 
 
+SessionHandler = Callable[
+    [Update, ContextTypes.DEFAULT_TYPE, AsyncSession], Awaitable[None]
+]
+
+
+def with_session(
+    handler: SessionHandler,
+) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]:
+    """Run the handler with one session shared by the whole Telegram update."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Транзакцию фиксируют сами обработчики: commit до ответа пользователю.
+        async with SessionLocal() as session:
+            await handler(update, context, session)
+
+    return wrapper
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data.clear()
     await update.message.reply_text(
@@ -224,14 +382,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def show_main_menu(update: Update, text: str) -> None:
     if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard())
+        await edit_message(update.callback_query, text, reply_markup=main_menu_keyboard())
     else:
         await update.message.reply_text(text, reply_markup=main_menu_keyboard())
 
 
 async def prompt_for_pet_name(update: Update) -> None:
-    await update.callback_query.edit_message_text(
-        "Введите имя питомца и отправьте сообщением."
+    await edit_message(
+        update.callback_query, "Введите имя питомца и отправьте сообщением."
     )
 
 
@@ -240,7 +398,7 @@ async def send_pet_selection(
 ) -> None:
     pets = await fetch_pets(session)
     if not pets:
-        await update.callback_query.edit_message_text(empty_message, reply_markup=main_menu_keyboard())
+        await edit_message(update.callback_query, empty_message, reply_markup=main_menu_keyboard())
         return
 
     buttons: list[list[InlineKeyboardButton]] = []
@@ -249,88 +407,101 @@ async def send_pet_selection(
             [InlineKeyboardButton(pet.name, callback_data=f"SELECT|{action}|{pet.id}")]
         )
     buttons.append([InlineKeyboardButton("Назад", callback_data=MAIN_MENU)])
-    await update.callback_query.edit_message_text(
-        "Выберите питомца:", reply_markup=InlineKeyboardMarkup(buttons)
+    await edit_message(
+        update.callback_query, "Выберите питомца:", reply_markup=InlineKeyboardMarkup(buttons)
     )
 
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+@with_session
+async def handle_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession
+) -> None:
     query = update.callback_query
     await query.answer()
 
     data = query.data
-    async with SessionLocal() as session:
-        if data == MAIN_MENU:
-            context.user_data.clear()
-            await show_main_menu(update, "Выберите действие:")
-        elif data == ADD_PET:
-            context.user_data.clear()
-            context.user_data["state"] = "ADD_PET_NAME"
-            await prompt_for_pet_name(update)
-        elif data == LIST_PETS:
-            pets = await fetch_pets(session)
-            if not pets:
-                text = "Питомцы ещё не добавлены"
-            else:
-                text = "Питомцы:\n" + "\n".join(pet.name for pet in pets)
-            await query.edit_message_text(text, reply_markup=main_menu_keyboard())
-        elif data == PET_INFO:
-            context.user_data.clear()
-            await send_pet_selection(
-                update, "INFO", session, "Питомцы ещё не добавлены"
-            )
-        elif data in {ADD_WEIGHT, ADD_CARE, ADD_VACCINE, ADD_EVENT}:
-            context.user_data.clear()
-            await send_pet_selection(update, data, session, "Сначала добавьте питомца")
-        elif data.startswith("SELECT|"):
-            try:
-                _, action, pet_id_str = data.split("|", 2)
-                pet_id = int(pet_id_str)
-            except ValueError:
-                await query.edit_message_text("Некорректные данные", reply_markup=main_menu_keyboard())
-                return
+    if data == MAIN_MENU:
+        context.user_data.clear()
+        await show_main_menu(update, "Выберите действие:")
+    elif data == ADD_PET:
+        context.user_data.clear()
+        context.user_data["state"] = "ADD_PET_NAME"
+        await prompt_for_pet_name(update)
+    elif data == LIST_PETS:
+        names = await fetch_pet_names(session)
+        if not names:
+            text = "Питомцы ещё не добавлены"
+        else:
+            text = "Питомцы:\n" + "\n".join(names)
+        await edit_message(query, text, reply_markup=main_menu_keyboard())
+    elif data == PET_INFO:
+        context.user_data.clear()
+        await send_pet_selection(
+            update, "INFO", session, "Питомцы ещё не добавлены"
+        )
+    elif data in {ADD_WEIGHT, ADD_CARE, ADD_VACCINE, ADD_EVENT}:
+        context.user_data.clear()
+        await send_pet_selection(update, data, session, "Сначала добавьте питомца")
+    elif data.startswith("SELECT|"):
+        try:
+            _, action, pet_id_str = data.split("|", 2)
+            pet_id = int(pet_id_str)
+        except ValueError:
+            await edit_message(query, "Некорректные данные", reply_markup=main_menu_keyboard())
+            return
 
-            context.user_data["pet_id"] = pet_id
-            context.user_data["state"] = action
-
-            prompts = {
-                "INFO": "Загружаю информацию...",
-                ADD_WEIGHT: "Введите вес питомца в килограммах (например, 5.3)",
-                ADD_CARE: "Опишите обработку (препарат, дозировка, причина)",
-                ADD_VACCINE: "Укажите вакцинацию (название препарата, дата)",
-                ADD_EVENT: "Опишите событие"
-            }
-
-            if action == "INFO":
-                pet = await session.get(Pet, pet_id)
-                if not pet:
-                    await query.edit_message_text(
-                        "Питомец не найден", reply_markup=main_menu_keyboard()
-                    )
-                    context.user_data.clear()
-                    return
-
-                await session.refresh(pet, attribute_names=["weights", "treatments", "vaccines", "events"])
-
-                lines = [
-                    f"Питомец: {pet.name}",
-                    format_entries(pet.weights, "Вес", lambda e: f"{e.value} кг"),
-                    format_entries(pet.treatments, "Обработки", lambda e: e.description),
-                    format_entries(pet.vaccines, "Вакцины", lambda e: e.description),
-                    format_entries(pet.events, "События", lambda e: e.description),
-                ]
-                await query.edit_message_text(
-                    "\n\n".join(lines), reply_markup=main_menu_keyboard()
+        context.user_data["pet_id"] = pet_id
+        context.user_data["state"] = action
+
+        prompts = {
+            "INFO": "Загружаю информацию...",
+            ADD_WEIGHT: "Введите вес питомца в килограммах (например, 5.3)",
+            ADD_CARE: "Опишите обработку (препарат, дозировка, причина)",
+            ADD_VACCINE: "Укажите вакцинацию (название препарата, дата)",
+            ADD_EVENT: "Опишите событие"
+        }
+
+        if action == "INFO":
+            stmt = (
+                select(Pet)
+                .where(Pet.id == pet_id)
+                .options(
+                    selectinload(Pet.weights),
+                    selectinload(Pet.treatments),
+                    selectinload(Pet.vaccines),
+                    selectinload(Pet.events),
+                )
+            )
+            pet = (await session.execute(stmt)).scalar_one_or_none()
+            if not pet:
+                await edit_message(
+                    query, "Питомец не найден", reply_markup=main_menu_keyboard()
                 )
                 context.user_data.clear()
                 return
 
-            await query.edit_message_text(prompts.get(action, "Введите данные"))
-        else:
-            await query.edit_message_text("Неизвестная команда", reply_markup=main_menu_keyboard())
+            lines = [
+                f"Питомец: {pet.name}",
+                format_entries(pet.weights, "Вес", lambda e: f"{e.value} кг"),
+                format_entries(pet.treatments, "Обработки", lambda e: e.description),
+                format_entries(pet.vaccines, "Вакцины", lambda e: e.description),
+                format_entries(pet.events, "События", lambda e: e.description),
+            ]
+            await edit_message(
+                query, "\n\n".join(lines), reply_markup=main_menu_keyboard()
+            )
+            context.user_data.clear()
+            return
+
+        await edit_message(query, prompts.get(action, "Введите данные"))
+    else:
+        await edit_message(query, "Неизвестная команда", reply_markup=main_menu_keyboard())
 
 
-async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+@with_session
+async def handle_user_message(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, session: AsyncSession
+) -> None:
     state = context.user_data.get("state")
     if not state:
         await update.message.reply_text(
@@ -339,81 +510,86 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     text = update.message.text.strip()
-    async with SessionLocal() as session:
-        if state == "ADD_PET_NAME":
-            if not text:
-                await update.message.reply_text("Имя не может быть пустым")
-                return
-            pet = await ensure_pet(session, text)
-            await update.message.reply_text(
-                f"Питомец {pet.name} добавлен.", reply_markup=main_menu_keyboard()
-            )
-            context.user_data.clear()
+    if state == "ADD_PET_NAME":
+        if not text:
+            await update.message.reply_text("Имя не может быть пустым")
             return
+        pet = await ensure_pet(session, text)
+        await update.message.reply_text(
+            f"Питомец {pet.name} добавлен.", reply_markup=main_menu_keyboard()
+        )
+        context.user_data.clear()
+        return
 
-        pet_id = context.user_data.get("pet_id")
-        if not pet_id:
-            await update.message.reply_text(
-                "Сначала выберите питомца через меню.", reply_markup=main_menu_keyboard()
-            )
-            context.user_data.clear()
-            return
+    pet_id = context.user_data.get("pet_id")
+    if not pet_id:
+        await update.message.reply_text(
+            "Сначала выберите питомца через меню.", reply_markup=main_menu_keyboard()
+        )
+        context.user_data.clear()
+        return
+
+    pet = await session.get(Pet, pet_id)
+    if not pet:
+        await update.message.reply_text(
+            "Питомец не найден", reply_markup=main_menu_keyboard()
+        )
+        context.user_data.clear()
+        return
 
-        pet = await session.get(Pet, pet_id)
-        if not pet:
+    if state == ADD_WEIGHT:
+        try:
+            value = float(text.translate(_DECIMAL_TRANSLATE))
+        except ValueError:
             await update.message.reply_text(
-                "Питомец не найден", reply_markup=main_menu_keyboard()
+                "Не удалось прочитать вес. Введите число, например 5.3"
             )
-            context.user_data.clear()
             return
 
-        if state == ADD_WEIGHT:
-            try:
-                value = float(text.replace(",", "."))
-            except ValueError:
-                await update.message.reply_text(
-                    "Не удалось прочитать вес. Введите число, например 5.3"
-                )
-                return
-
-            entry = WeightEntry(pet_id=pet.id, value=value)
-            session.add(entry)
-            await session.commit()
-            await update.message.reply_text(
-                f"Вес {value} кг сохранён для {pet.name}",
-                reply_markup=main_menu_keyboard(),
-            )
-        elif state == ADD_CARE:
-            entry = TreatmentEntry(pet_id=pet.id, description=text)
-            session.add(entry)
-            await session.commit()
-            await update.message.reply_text(
-                f"Обработка сохранена для {pet.name}", reply_markup=main_menu_keyboard()
-            )
-        elif state == ADD_VACCINE:
-            entry = VaccineEntry(pet_id=pet.id, description=text)
-            session.add(entry)
-            await session.commit()
-            await update.message.reply_text(
-                f"Вакцинация сохранена для {pet.name}", reply_markup=main_menu_keyboard()
-            )
-        elif state == ADD_EVENT:
-            entry = EventEntry(pet_id=pet.id, description=text)
-            session.add(entry)
-            await session.commit()
-            await update.message.reply_text(
-                f"Событие сохранено для {pet.name}", reply_markup=main_menu_keyboard()
-            )
-        else:
-            await update.message.reply_text(
-                "Неизвестная операция", reply_markup=main_menu_keyboard()
-            )
+        await session.execute(insert(WeightEntry).values(pet_id=pet.id, value=value))
+        await session.commit()
+        await update.message.reply_text(
+            f"Вес {value} кг сохранён для {pet.name}",
+            reply_markup=main_menu_keyboard(),
+        )
+    elif state == ADD_CARE:
+        await session.execute(insert(TreatmentEntry).values(pet_id=pet.id, description=text))
+        await session.commit()
+        await update.message.reply_text(
+            f"Обработка сохранена для {pet.name}", reply_markup=main_menu_keyboard()
+        )
+    elif state == ADD_VACCINE:
+        await session.execute(insert(VaccineEntry).values(pet_id=pet.id, description=text))
+        await session.commit()
+        await update.message.reply_text(
+            f"Вакцинация сохранена для {pet.name}", reply_markup=main_menu_keyboard()
+        )
+    elif state == ADD_EVENT:
+        await session.execute(insert(EventEntry).values(pet_id=pet.id, description=text))
+        await session.commit()
+        await update.message.reply_text(
+            f"Событие сохранено для {pet.name}", reply_markup=main_menu_keyboard()
+        )
+    else:
+        await update.message.reply_text(
+            "Неизвестная операция", reply_markup=main_menu_keyboard()
+        )
 
     context.user_data.clear()
 
 
+async def enable_eager_tasks(application: Application) -> None:
+    # Корутины, завершающиеся без ожидания, выполняются сразу, без лишнего
+    # прохода планировщика. eager_task_factory появился в Python 3.12.
+    eager_task_factory = getattr(asyncio, "eager_task_factory", None)
+    if eager_task_factory is not None:
+        asyncio.get_running_loop().set_task_factory(eager_task_factory)
+
+
 def build_application(token: str) -> Application:
-    application = Application.builder().token(token).build()
+    application = (
+        Application.builder().token(token).post_init(enable_eager_tasks).build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(handle_callback))
@@ -429,6 +605,9 @@ def main() -> None:
     if not token:
         raise RuntimeError("TELEGRAM_TOKEN не задан. Установите переменную окружения.")
 
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     asyncio.run(init_db())
 
     application = build_application(token)